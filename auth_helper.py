@@ -1,7 +1,10 @@
 # auth_helper.py
 from stravalib.client import Client
+import http.server
+import urllib.parse
 import webbrowser
 import os
+import shutil
 from dotenv import load_dotenv
 
 # Load .env file if it exists
@@ -16,22 +19,62 @@ if not CLIENT_ID or not CLIENT_SECRET:
     print("Error: STRAVA_CLIENT_ID and STRAVA_CLIENT_SECRET must be set in .env file")
     exit(1)
 
+# Local address Strava redirects back to after authorization
+REDIRECT_PORT = 8000
+REDIRECT_URI = f'http://localhost:{REDIRECT_PORT}'
+
+
+class AuthRedirectHandler(http.server.BaseHTTPRequestHandler):
+    """Capture the code (or error) from Strava's redirect to localhost"""
+    code = None
+    error = None
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        AuthRedirectHandler.code = query.get('code', [None])[0]
+        AuthRedirectHandler.error = query.get('error', [None])[0]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        if AuthRedirectHandler.code:
+            self.wfile.write(b'Authorization complete, you can close this tab.')
+        else:
+            self.wfile.write(b'Authorization failed, check the terminal.')
+
+    def log_message(self, format, *args):
+        # Keep the request log out of the terminal
+        pass
+
+
 # Create the client
 client = Client()
 
 # Get the authorization URL
 auth_url = client.authorization_url(
     client_id=CLIENT_ID,
-    redirect_uri='http://localhost',
+    redirect_uri=REDIRECT_URI,
     scope=['read', 'activity:read_all']
 )
 
+# Start listening before opening the browser so the redirect can't be missed
+server = http.server.HTTPServer(('localhost', REDIRECT_PORT), AuthRedirectHandler)
+
 # Open the authorization URL in a browser
 print("Opening browser for authorization...")
+print(f"If it doesn't open, visit: {auth_url}")
 webbrowser.open(auth_url)
 
-# Ask the user for the code from the redirect
-code = input("Enter the code from the URL after authorization (after 'code=' in the URL): ")
+# Wait for Strava to redirect back with the code (ignoring stray requests such as favicons)
+with server:
+    while AuthRedirectHandler.code is None and AuthRedirectHandler.error is None:
+        server.handle_request()
+
+if AuthRedirectHandler.error:
+    print(f"Error: authorization failed ({AuthRedirectHandler.error})")
+    exit(1)
+
+code = AuthRedirectHandler.code
 
 # Exchange the code for tokens
 token_response = client.exchange_code_for_token(
@@ -42,29 +85,33 @@ token_response = client.exchange_code_for_token(
 
 # Update or create .env file
 env_path = '.env'
-env_lines = []
-
-# Read existing .env file if it exists
-if os.path.exists(env_path):
-    with open(env_path, 'r') as f:
-        env_lines = f.readlines()
+tmp_path = env_path + '.tmp'
 
 # Update or add STRAVA_REFRESH_TOKEN
 refresh_token_line = f"STRAVA_REFRESH_TOKEN={token_response['refresh_token']}\n"
 found = False
 
-for i, line in enumerate(env_lines):
-    if line.startswith('STRAVA_REFRESH_TOKEN='):
-        env_lines[i] = refresh_token_line
-        found = True
-        break
+# Copy the existing .env file line by line into a temporary file, swapping in the new token
+# (created owner-only so the secrets are never readable by others, even briefly)
+with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as dst:
+    if os.path.exists(env_path):
+        with open(env_path, 'r') as src:
+            for line in src:
+                if line.startswith('STRAVA_REFRESH_TOKEN='):
+                    dst.write(refresh_token_line)
+                    found = True
+                else:
+                    dst.write(line)
+
+    if not found:
+        dst.write(refresh_token_line)
 
-if not found:
-    env_lines.append(refresh_token_line)
+# Keep the original permissions, since .env holds the client secret and refresh token
+if os.path.exists(env_path):
+    shutil.copymode(env_path, tmp_path)
 
-# Write back to .env file
-with open(env_path, 'w') as f:
-    f.writelines(env_lines)
+# Replace the .env file in one step so an interrupted write never leaves it half-written
+os.replace(tmp_path, env_path)
 
 print("\nSuccessfully updated .env file with new refresh token!")
 print("You can now run strava_chain_tracker.py")
\ No newline at end of file
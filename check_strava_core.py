@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# Runnable checks for strava_core
+# Exercises the activity cache against a fake Strava API and an in-memory database,
+# and the chain markers against synthetic activities, without any network access or credentials. Run with: python check_strava_core.py
+
+import datetime
+from itertools import product
+from types import SimpleNamespace
+from strava_core import (
+	CHAIN_START_EMOJI, CHAIN_END_EMOJI, StoredActivity,
+	open_activity_db, fetch_all_activities, classify_chain_markers, aggregate_kilometers
+)
+
+
+class FakeProtocol:
+	"""Serves /athlete/activities pages from a list of raw activities, recording each request"""
+
+	def __init__(self, activities):
+		self.activities = activities
+		self.requests = []
+
+	def get(self, url, after, page, per_page):
+		self.requests.append((after, page))
+
+		newer = sorted(
+			(activity for activity in self.activities if parse_date(activity['start_date']).timestamp() > after),
+			key=lambda activity: activity['start_date']
+		)
+		return newer[(page - 1) * per_page:page * per_page]
+
+
+def parse_date(value):
+	"""Parse a Strava-style UTC timestamp"""
+	return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def make_raw_activities(count, now):
+	"""One ride every 12 hours going back from now"""
+	return [
+		{
+			'id': i,
+			'start_date': (now - datetime.timedelta(hours=12 * i + 1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+			'name': f"Ride {i}",
+			'type': 'Ride',
+			'distance': 1000.0
+		}
+		for i in range(count)
+	]
+
+
+def check_windows_share_cache():
+	"""A short-window run must not stop a later long-window run fetching its older days"""
+	now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+	raw_activities = make_raw_activities(800, now)
+	client = SimpleNamespace(protocol=FakeProtocol(raw_activities))
+	conn = open_activity_db(':memory:')
+
+	expected_180 = sum(1 for a in raw_activities if parse_date(a['start_date']) >= now - datetime.timedelta(days=180))
+	expected_365 = sum(1 for a in raw_activities if parse_date(a['start_date']) >= now - datetime.timedelta(days=365))
+
+	assert len(fetch_all_activities(client, conn, days=180)) == expected_180
+	assert len(fetch_all_activities(client, conn, days=365)) == expected_365
+	assert len(fetch_all_activities(client, conn, days=180)) == expected_180
+
+
+def check_overlap_refetch():
+	"""Repeat runs re-fetch the last week, picking up renames and late uploads"""
+	now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+	raw_activities = make_raw_activities(100, now)
+	protocol = FakeProtocol(raw_activities)
+	client = SimpleNamespace(protocol=protocol)
+	conn = open_activity_db(':memory:')
+
+	fetch_all_activities(client, conn, days=180)
+
+	# A recent ride renamed to start a chain, and a ride uploaded late with an earlier start date
+	raw_activities[3]['name'] = 'Ride 3 ⛓️'
+	raw_activities.append({
+		'id': 1000,
+		'start_date': (now - datetime.timedelta(days=3)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+		'name': 'Late upload',
+		'type': 'Ride',
+		'distance': 1000.0
+	})
+
+	activities = {activity.id: activity for activity in fetch_all_activities(client, conn, days=180)}
+	assert activities[3].name == 'Ride 3 ⛓️'
+	assert 1000 in activities
+
+	# The incremental run only asked for the overlap, not the whole window
+	latest = parse_date(raw_activities[0]['start_date'])
+	assert protocol.requests[-1] == (int((latest - datetime.timedelta(days=7)).timestamp()), 1)
+
+
+def make_activity(activity_id, name, description=None):
+	"""A cached ride on consecutive days, so the ids give the date order"""
+	start_date = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=activity_id)
+	return StoredActivity(activity_id, start_date, name, description, 'Ride', 1000.0)
+
+
+def check_marker_combinations():
+	"""Each field is checked on its own: a start needs a field with the start but not the end emoji"""
+	field_values = [
+		None,
+		'',
+		'Ride',
+		f"Ride {CHAIN_START_EMOJI}",
+		f"Ride {CHAIN_END_EMOJI}",
+		f"Ride {CHAIN_START_EMOJI} to {CHAIN_END_EMOJI}"
+	]
+
+	def field_markers(value):
+		value = value or ''
+		return CHAIN_START_EMOJI in value and CHAIN_END_EMOJI not in value, CHAIN_END_EMOJI in value
+
+	for name, description in product(field_values, repeat=2):
+		name_start, name_end = field_markers(name)
+		description_start, description_end = field_markers(description)
+		expected = (name_start or description_start, name_end or description_end)
+
+		assert classify_chain_markers(make_activity(1, name, description)) == expected, (name, description)
+
+	# A ride ending one chain in its name and starting the next in its description is both
+	assert classify_chain_markers(make_activity(1, f"Ride {CHAIN_END_EMOJI}", f"Ride {CHAIN_START_EMOJI}")) == (True, True)
+
+
+def check_chain_spans():
+	"""A start closes any open chain, and an activity that is both start and end is a chain of one"""
+	activities = [
+		make_activity(1, 'Before'),
+		make_activity(2, f"Ride {CHAIN_START_EMOJI}"),
+		make_activity(3, 'Middle'),
+		make_activity(4, f"Ride {CHAIN_END_EMOJI}", f"Ride {CHAIN_START_EMOJI}"),
+		make_activity(5, 'Between'),
+		make_activity(6, 'Stray end', f"Ride {CHAIN_END_EMOJI}"),
+		make_activity(7, f"Ride {CHAIN_START_EMOJI}"),
+		make_activity(8, 'Still open')
+	]
+
+	chains = aggregate_kilometers(activities)
+	assert [[activity['id'] for activity in chain['activities']] for chain in chains] == [[2, 3], [4], [7, 8]]
+	assert [chain['total_km'] for chain in chains] == [2.0, 1.0, 2.0]
+
+
+def main():
+	checks = [
+		check_windows_share_cache,
+		check_overlap_refetch,
+		check_marker_combinations,
+		check_chain_spans
+	]
+
+	for check in checks:
+		check()
+		print(f"ok  {check.__name__}")
+
+	print(f"All {len(checks)} checks passed")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+# Compile the Jinja templates ahead of time
+# Run this again after changing anything in templates/; until then the reports
+# fall back to parsing the template sources
+
+from strava_core import compile_templates
+
+
+if __name__ == "__main__":
+	compile_templates()
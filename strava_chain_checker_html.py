@@ -4,368 +4,175 @@
 
 import os
 import datetime
-import time
-from dotenv import load_dotenv
-from stravalib.client import Client
-from stravalib import unithelper
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from strava_core import TEMPLATE_DIR, get_env, setup_client, open_activity_db, fetch_all_activities, filter_ride_activities, aggregate_kilometers
+
+_TEMPLATE = get_env().get_template('page_body.html')
+_CHAIN_TEMPLATE = get_env().get_template('chain_card.html')
+
+
+def read_template_source(name):
+	"""Read the raw source of a template file"""
+	with open(os.path.join(TEMPLATE_DIR, name), 'r', encoding='utf-8') as f:
+		return f.read()
+
+
+# The page head (with all the CSS) and footer never change, so they are read once
+# and written verbatim around the rendered body instead of going through Jinja
+STATIC_HEADER = read_template_source('static_header.html')
+STATIC_FOOTER = read_template_source('static_footer.html')
+
+# Rendered chain cards are cached next to the website, keyed by chain signature.
+# The template digest salts the signature so template edits invalidate the cache.
+CHAIN_CACHE_FILENAME = 'chains_cache.json'
+_CHAIN_TEMPLATE_DIGEST = hashlib.blake2b(read_template_source('chain_card.html').encode('utf-8'), digest_size=16).digest()
+
+# Below this many chains to render, starting worker processes costs more than it saves
+PARALLEL_RENDER_THRESHOLD = 8
+
+
+def prepare_chain_rows(chain):
+	"""Precompute the table rows (running totals, progress and notes) for a chain"""
+	rows = []
+	running_totals = accumulate(activity['distance_km'] for activity in chain['activities'])
+
+	for activity, running_total in zip(chain['activities'], running_totals):
+		row_class = ""
+		notes = []
+
+		if activity.get('is_chain_start'):
+			row_class = "chain-start"
+			notes.append("Chain Start")
+		if activity.get('is_chain_end'):
+			row_class = "chain-end"
+			notes.append("Chain End")
+
+		rows.append({
+			'date': activity['date'].date().isoformat(),
+			'name': activity['name'],
+			'distance_km': activity['distance_km'],
+			'running_total': running_total,
+			# Progress percentage for the background gradient
+			'progress_percent': (running_total / chain['total_km']) * 100,
+			'row_class': row_class,
+			'notes': ", ".join(notes)
+		})
+
+	return rows
+
+
+def chain_signature(index, chain):
+	"""Hash everything a rendered chain card depends on"""
+	key = (
+		index,
+		chain['start_date'],
+		chain['end_date'],
+		round(chain['total_km'], 2),
+		tuple(
+			(a['id'], a['name'], a['distance_km'], a['is_chain_start'], a['is_chain_end'])
+			for a in chain['activities']
+		)
+	)
+	return hashlib.blake2b(repr(key).encode('utf-8'), salt=_CHAIN_TEMPLATE_DIGEST).hexdigest()
 
-# Load environment variables from .env file
-load_dotenv()
 
-# Strava API credentials
-CLIENT_ID = os.getenv('STRAVA_CLIENT_ID')
-CLIENT_SECRET = os.getenv('STRAVA_CLIENT_SECRET')
-REFRESH_TOKEN = os.getenv('STRAVA_REFRESH_TOKEN')
+def load_chain_cache(path):
+	"""Load the cached chain cards, or an empty cache if there is none"""
+	try:
+		with open(path, 'r', encoding='utf-8') as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
 
-# Chain emoji markers
-CHAIN_START_EMOJI = '⛓️'
-CHAIN_END_EMOJI = '⛓️‍💥'
 
+def save_chain_cache(cache, path):
+	"""Atomically write the chain card cache"""
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'w', encoding='utf-8') as f:
+		json.dump(cache, f)
+	os.replace(tmp_path, path)
 
-def setup_client():
-	"""Create and authenticate a Strava client"""
-	client = Client()
 
-	# Exchange the refresh token for a fresh access token
-	refresh_response = client.refresh_access_token(
-		client_id=CLIENT_ID,
-		client_secret=CLIENT_SECRET,
-		refresh_token=REFRESH_TOKEN
-	)
+def render_chain(index, chain):
+	"""Render a single chain card"""
+	return _CHAIN_TEMPLATE.render(index=index, chain=chain, rows=prepare_chain_rows(chain))
 
-	# Set the access token on the client
-	client.access_token = refresh_response['access_token']
 
-	return client
+def render_chain_fragments(chains, cache=None):
+	"""Render each chain card, reusing cached fragments for unchanged chains
 
+	The cache is updated in place to hold exactly the current chains.
+	"""
+	signatures = [chain_signature(i + 1, chain) for i, chain in enumerate(chains)]
+	fragments = [cache.get(signature) if cache is not None else None for signature in signatures]
 
-def fetch_all_activities(client):
-	"""Fetch activities from Strava for the last 6 months"""
-	print('Fetching activities from the last 6 months...')
+	missing = [i for i, fragment in enumerate(fragments) if fragment is None]
+	missing_indexes = [i + 1 for i in missing]
+	missing_chains = [chains[i] for i in missing]
 
-	# Calculate date 6 months ago from today
-	today = datetime.datetime.now()
-	six_months_ago = today - datetime.timedelta(days=365)  # Approximately 6 months
+	# Chain cards are independent, so render larger batches in worker processes
+	if len(missing) < PARALLEL_RENDER_THRESHOLD:
+		rendered = list(map(render_chain, missing_indexes, missing_chains))
+	else:
+		with ProcessPoolExecutor() as executor:
+			rendered = list(executor.map(render_chain, missing_indexes, missing_chains, chunksize=4))
 
-	print(f"Getting activities since: {six_months_ago.strftime('%Y-%m-%d')}")
+	for i, fragment in zip(missing, rendered):
+		fragments[i] = fragment
 
-	# stravalib handles pagination internally when we use the iterator
-	all_activities = []
-	count = 0
+	if cache is not None:
+		cache.clear()
+		cache.update(zip(signatures, fragments))
 
-	# Get activities using the iterator with the after parameter
-	for activity in client.get_activities(after=six_months_ago):
-		all_activities.append(activity)
-		count += 1
+	return fragments
 
-		# Print progress after every 30 activities (approximately one page)
-		if count % 30 == 0:
-			print(f"Fetched {count} activities so far")
 
-		# Be nice to the API rate limits
-		if count % 10 == 0:  # Add a small delay every 10 activities
-			time.sleep(0.1)
+def build_template_context(chains, cache=None):
+	"""Build the variables passed to the HTML template"""
+	# Find the longest chain by distance, along with its position, in one pass
+	longest_index, longest_chain = max(enumerate(chains), key=lambda pair: pair[1]['total_km']) if chains else (-1, None)
 
-	print(f"Total activities fetched: {len(all_activities)}")
-	return all_activities
+	return {
+		'now': datetime.datetime.now(),
+		'fragments': render_chain_fragments(chains, cache),
+		'totals': {
+			'chains': len(chains),
+			'distance': sum(chain['total_km'] for chain in chains),
+			'activities': sum(len(chain['activities']) for chain in chains),
+			'longest_chain_distance': longest_chain['total_km'] if longest_chain else 0,
+			'longest_chain_index': longest_index + 1 if longest_chain else 0
+		}
+	}
 
 
-def filter_ride_activities(activities):
-	"""Filter only cycling activities"""
-	return [activity for activity in activities if activity.type == 'Ride']
+def write_html(chains, fh, cache=None):
+	"""Stream the complete HTML website for the chains data to an open file"""
+	fh.write(STATIC_HEADER)
+	_TEMPLATE.stream(**build_template_context(chains, cache)).dump(fh)
+	fh.write(STATIC_FOOTER)
 
 
-def has_chain_start_emoji(activity):
-	"""Check if an activity contains the chain start emoji in name or description"""
-	# Check in name
-	if activity.name and CHAIN_START_EMOJI in activity.name and CHAIN_END_EMOJI not in activity.name:
-		return True
+def save_html(chains, filename='strava_chains_website.html'):
+	"""Save the HTML website to a file, reusing cached chain cards"""
+	cache_path = os.path.join(os.path.dirname(os.path.abspath(filename)), CHAIN_CACHE_FILENAME)
+	cache = load_chain_cache(cache_path)
 
-	# Check in description
-	if activity.description and CHAIN_START_EMOJI in activity.description and CHAIN_END_EMOJI not in activity.description:
-		return True
+	# Render into a temporary file so a failed run never replaces the last good website
+	tmp_filename = filename + '.tmp'
+	with open(tmp_filename, 'w', encoding='utf-8') as f:
+		try:
+			write_html(chains, f, cache)
+		except BaseException:
+			f.close()
+			os.remove(tmp_filename)
+			raise
 
-	return False
+	os.replace(tmp_filename, filename)
+	save_chain_cache(cache, cache_path)
 
-
-def has_chain_end_emoji(activity):
-	"""Check if an activity contains the chain end emoji in name or description"""
-	# Check in name
-	if activity.name and CHAIN_END_EMOJI in activity.name:
-		return True
-
-	# Check in description
-	if activity.description and CHAIN_END_EMOJI in activity.description:
-		return True
-
-	return False
-
-
-def aggregate_kilometers(activities):
-	"""Aggregate kilometers based on chain start and end emoji markers"""
-	# Sort activities by date (oldest first)
-	activities.sort(key=lambda a: a.start_date)
-
-	chains = []
-	current_chain = None
-	in_chain = False
-
-	# Process each activity
-	for activity in activities:
-		# Check for chain markers
-		is_chain_start = has_chain_start_emoji(activity)
-		is_chain_end = has_chain_end_emoji(activity)
-
-		# Convert distance to kilometers
-		distance_km = float(unithelper.kilometers(activity.distance))
-		activity_date = activity.start_date.replace(tzinfo=None)  # Remove timezone info for easier formatting
-
-		# Start a new chain if we see the start emoji
-		if is_chain_start:
-			# If we were already in a chain, finalize it before starting a new one
-			if in_chain and current_chain is not None:
-				chains.append(current_chain)
-
-			# Start a new chain
-			current_chain = {
-				'start_date': activity_date,
-				'end_date': activity_date,  # Will be updated as we go
-				'activities': [],
-				'total_km': 0
-			}
-			in_chain = True
-
-		# If we're in a chain, add the activity
-		if in_chain and current_chain is not None:
-			current_chain['activities'].append({
-				'id': activity.id,
-				'name': activity.name,
-				'date': activity_date,
-				'distance_km': round(distance_km, 2),
-				'is_chain_start': is_chain_start,
-				'is_chain_end': is_chain_end
-			})
-
-			current_chain['total_km'] += distance_km
-			current_chain['end_date'] = activity_date
-
-			# End the chain if we see the end emoji
-			if is_chain_end:
-				chains.append(current_chain)
-				current_chain = None
-				in_chain = False
-
-	# Add the last chain if it's still open
-	if in_chain and current_chain is not None and current_chain['activities']:
-		chains.append(current_chain)
-
-	return chains
-
-
-def generate_html(chains):
-	"""Generate a complete HTML website from the chains data"""
-
-	# Calculate some overall statistics
-	total_chains = len(chains)
-	total_distance = sum(chain['total_km'] for chain in chains)
-	total_activities = sum(len(chain['activities']) for chain in chains)
-
-	# Find the longest chain by distance
-	longest_chain = max(chains, key=lambda x: x['total_km']) if chains else None
-	longest_chain_distance = longest_chain['total_km'] if longest_chain else 0
-	longest_chain_index = chains.index(longest_chain) + 1 if longest_chain else 0
-
-	html = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Strava Chain Tracker</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
-    <style>
-        body {{
-            padding-top: 20px;
-            padding-bottom: 40px;
-        }}
-        .chain-card {{
-            margin-bottom: 30px;
-            border-radius: 10px;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-        }}
-        .chain-header {{
-            background-color: #fc4c02;
-            color: white;
-            padding: 15px;
-            border-top-left-radius: 10px;
-            border-top-right-radius: 10px;
-        }}
-        .chain-body {{
-            padding: 20px;
-        }}
-        .stats-card {{
-            background-color: #f8f9fa;
-            border-radius: 10px;
-            padding: 20px;
-            margin-bottom: 30px;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-        }}
-        .chain-start {{
-            background-color: #d4edda;
-        }}
-        .chain-end {{
-            background-color: #f8d7da;
-        }}
-        .progress-column {{
-            background: linear-gradient(90deg, 
-                rgba(223, 240, 216, 0.5) 0%, 
-                rgba(223, 240, 216, 0.5) var(--progress-percent), 
-                transparent var(--progress-percent), 
-                transparent 100%);
-        }}
-        .strava-header {{
-            background-color: #fc4c02;
-            color: white;
-            padding: 15px 0;
-            margin-bottom: 30px;
-        }}
-        .last-updated {{
-            font-size: 0.8em;
-            color: #6c757d;
-            margin-top: 5px;
-        }}
-    </style>
-</head>
-<body>
-    <div class="strava-header">
-        <div class="container">
-            <h1 class="display-4">⛓️ Strava Chain Tracker</h1>
-            <p class="lead">Track your cycling chains and achievements</p>
-            <p class="last-updated">Last updated: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}</p>
-        </div>
-    </div>
-
-    <div class="container">
-        <!-- Overall Statistics -->
-        <div class="row stats-card">
-            <div class="col-md-3">
-                <h4>Total Chains</h4>
-                <h2>{total_chains}</h2>
-            </div>
-            <div class="col-md-3">
-                <h4>Total Distance</h4>
-                <h2>{total_distance:.2f} km</h2>
-            </div>
-            <div class="col-md-3">
-                <h4>Total Activities</h4>
-                <h2>{total_activities}</h2>
-            </div>
-            <div class="col-md-3">
-                <h4>Longest Chain</h4>
-                <h2>{longest_chain_distance:.2f} km</h2>
-                <p>Chain #{longest_chain_index}</p>
-            </div>
-        </div>
-
-        <!-- Individual Chains -->
-"""
-
-	# Add each chain to the HTML
-	for i, chain in enumerate(chains):
-		start_date_str = chain['start_date'].strftime("%Y-%m-%d")
-		end_date_str = chain['end_date'].strftime("%Y-%m-%d")
-
-		html += f"""
-        <div class="chain-card">
-            <div class="chain-header">
-                <h2>Chain {i + 1}</h2>
-                <p class="mb-0">Period: {start_date_str} to {end_date_str}</p>
-            </div>
-            <div class="chain-body">
-                <div class="row mb-3">
-                    <div class="col-md-6">
-                        <h4>Total Distance</h4>
-                        <h3>{chain['total_km']:.2f} km</h3>
-                    </div>
-                    <div class="col-md-6">
-                        <h4>Number of Rides</h4>
-                        <h3>{len(chain['activities'])}</h3>
-                    </div>
-                </div>
-
-                <table class="table table-striped">
-                    <thead>
-                        <tr>
-                            <th>Date</th>
-                            <th>Activity Name</th>
-                            <th>Distance (km)</th>
-                            <th>Running Total (km)</th>
-                            <th>Notes</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-"""
-
-		running_total = 0
-		for activity in chain['activities']:
-			date_str = activity['date'].strftime("%Y-%m-%d")
-			name_str = activity['name']
-			distance = activity['distance_km']
-			running_total += distance
-
-			# Calculate progress percentage for background gradient
-			progress_percent = (running_total / chain['total_km']) * 100
-
-			row_class = ""
-			notes = []
-
-			if activity.get('is_chain_start'):
-				row_class = "chain-start"
-				notes.append("Chain Start")
-			if activity.get('is_chain_end'):
-				row_class = "chain-end"
-				notes.append("Chain End")
-
-			notes_str = ", ".join(notes)
-
-			html += f"""
-                        <tr class="{row_class}">
-                            <td>{date_str}</td>
-                            <td>{name_str}</td>
-                            <td>{distance}</td>
-                            <td class="progress-column" style="--progress-percent: {progress_percent}%;">{running_total:.2f}</td>
-                            <td>{notes_str}</td>
-                        </tr>
-"""
-
-		html += """
-                    </tbody>
-                </table>
-            </div>
-        </div>
-"""
-
-	# Close the HTML document
-	html += """
-    </div>
-
-    <footer class="bg-light py-4 mt-4">
-        <div class="container text-center">
-            <p>Powered by the Strava API</p>
-        </div>
-    </footer>
-
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js"></script>
-</body>
-</html>
-"""
-
-	return html
-
-
-def save_html(content, filename='strava_chains_website.html'):
-	"""Save the HTML website to a file"""
-	with open(filename, 'w', encoding='utf-8') as f:
-		f.write(content)
 	print(f"Website saved to {filename}")
 
 
@@ -377,8 +184,10 @@ def main():
 		# Set up the Strava client
 		client = setup_client()
 
-		# Fetch all activities
-		all_activities = fetch_all_activities(client)
+		# Fetch new activities into the local cache and load the recent ones
+		conn = open_activity_db()
+		all_activities = fetch_all_activities(client, conn, days=365)
+		conn.close()
 
 		# Filter only cycling activities
 		ride_activities = filter_ride_activities(all_activities)
@@ -389,8 +198,7 @@ def main():
 		print(f"Identified {len(chains)} chains")
 
 		# Generate and save the HTML website
-		html_content = generate_html(chains)
-		save_html(html_content)
+		save_html(chains)
 
 		print('Done! Website successfully generated.')
 
@@ -3,164 +3,8 @@
 # This script retrieves all activities from your Strava account and aggregates
 # kilometers ridden, restarting the count whenever a ⛓️ emoji is encountered
 
-import os
-import datetime
-import time
-from dotenv import load_dotenv
-from stravalib.client import Client
-from stravalib import unithelper
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Strava API credentials - store these in a .env file
-CLIENT_ID = os.getenv('STRAVA_CLIENT_ID')
-CLIENT_SECRET = os.getenv('STRAVA_CLIENT_SECRET')
-REFRESH_TOKEN = os.getenv('STRAVA_REFRESH_TOKEN')
-
-# Chain emoji markers
-CHAIN_START_EMOJI = '⛓️'
-CHAIN_END_EMOJI = '⛓️‍💥'
-
-
-def setup_client():
-	"""Create and authenticate a Strava client"""
-	client = Client()
-
-	# Exchange the refresh token for a fresh access token
-	refresh_response = client.refresh_access_token(
-		client_id=CLIENT_ID,
-		client_secret=CLIENT_SECRET,
-		refresh_token=REFRESH_TOKEN
-	)
-
-	# Set the access token on the client
-	client.access_token = refresh_response['access_token']
-
-	return client
-
-
-def fetch_all_activities(client):
-	"""Fetch activities from Strava for the last 6 months"""
-	print('Fetching activities from the last 6 months...')
-
-	# Calculate date 6 months ago from today
-	today = datetime.datetime.now()
-	six_months_ago = today - datetime.timedelta(days=180)  # Approximately 6 months
-
-	print(f"Getting activities since: {six_months_ago.strftime('%Y-%m-%d')}")
-
-	# stravalib handles pagination internally when we use the iterator
-	all_activities = []
-	count = 0
-
-	# Get activities using the iterator with the after parameter
-	for activity in client.get_activities(after=six_months_ago):
-		all_activities.append(activity)
-		count += 1
-
-		# Print progress after every 30 activities (approximately one page)
-		if count % 30 == 0:
-			print(f"Fetched {count} activities so far")
-
-		# Be nice to the API rate limits
-		if count % 10 == 0:  # Add a small delay every 10 activities
-			time.sleep(0.1)
-
-	print(f"Total activities fetched: {len(all_activities)}")
-	return all_activities
-
-
-def filter_ride_activities(activities):
-	"""Filter only cycling activities"""
-	return [activity for activity in activities if activity.type == 'Ride']
-
-
-def has_chain_start_emoji(activity):
-	"""Check if an activity contains the chain start emoji in name or description"""
-	# Check in name
-	if activity.name and CHAIN_START_EMOJI in activity.name and CHAIN_END_EMOJI not in activity.name:
-		return True
-
-	# Check in description
-	if activity.description and CHAIN_START_EMOJI in activity.description and CHAIN_END_EMOJI not in activity.description:
-		return True
-
-	return False
-
-
-def has_chain_end_emoji(activity):
-	"""Check if an activity contains the chain end emoji in name or description"""
-	# Check in name
-	if activity.name and CHAIN_END_EMOJI in activity.name:
-		return True
-
-	# Check in description
-	if activity.description and CHAIN_END_EMOJI in activity.description:
-		return True
-
-	return False
-
-
-def aggregate_kilometers(activities):
-	"""Aggregate kilometers based on chain start and end emoji markers"""
-	# Sort activities by date (oldest first)
-	activities.sort(key=lambda a: a.start_date)
-
-	chains = []
-	current_chain = None
-	in_chain = False
-
-	# Process each activity
-	for activity in activities:
-		# Check for chain markers
-		is_chain_start = has_chain_start_emoji(activity)
-		is_chain_end = has_chain_end_emoji(activity)
-
-		# Convert distance to kilometers
-		distance_km = float(unithelper.kilometers(activity.distance))
-		activity_date = activity.start_date.replace(tzinfo=None)  # Remove timezone info for easier formatting
-
-		# Start a new chain if we see the start emoji
-		if is_chain_start:
-			# If we were already in a chain, finalize it before starting a new one
-			if in_chain and current_chain is not None:
-				chains.append(current_chain)
-
-			# Start a new chain
-			current_chain = {
-				'start_date': activity_date,
-				'end_date': activity_date,  # Will be updated as we go
-				'activities': [],
-				'total_km': 0
-			}
-			in_chain = True
-
-		# If we're in a chain, add the activity
-		if in_chain and current_chain is not None:
-			current_chain['activities'].append({
-				'id': activity.id,
-				'name': activity.name,
-				'date': activity_date,
-				'distance_km': round(distance_km, 2),
-				'is_chain_start': is_chain_start,
-				'is_chain_end': is_chain_end
-			})
-
-			current_chain['total_km'] += distance_km
-			current_chain['end_date'] = activity_date
-
-			# End the chain if we see the end emoji
-			if is_chain_end:
-				chains.append(current_chain)
-				current_chain = None
-				in_chain = False
-
-	# Add the last chain if it's still open
-	if in_chain and current_chain is not None and current_chain['activities']:
-		chains.append(current_chain)
-
-	return chains
+from itertools import accumulate
+from strava_core import setup_client, open_activity_db, fetch_all_activities, filter_ride_activities, aggregate_kilometers
 
 
 def format_results(chains):
@@ -168,8 +12,8 @@ def format_results(chains):
 	output = "# Strava Ride Chains Summary\n\n"
 
 	for i, chain in enumerate(chains):
-		start_date_str = chain['start_date'].strftime("%Y-%m-%d")
-		end_date_str = chain['end_date'].strftime("%Y-%m-%d")
+		start_date_str = chain['start_date'].date().isoformat()
+		end_date_str = chain['end_date'].date().isoformat()
 
 		output += f"## Chain {i + 1}\n"
 		output += f"- **Period**: {start_date_str} to {end_date_str}\n"
@@ -180,12 +24,11 @@ def format_results(chains):
 		output += "| Date | Activity Name | Distance (km) | Running Total (km) | Notes |\n"
 		output += "|------|--------------|---------------|-------------------|-------|\n"
 
-		running_total = 0
-		for activity in chain['activities']:
-			date_str = activity['date'].strftime("%Y-%m-%d")
+		running_totals = accumulate(activity['distance_km'] for activity in chain['activities'])
+		for activity, running_total in zip(chain['activities'], running_totals):
+			date_str = activity['date'].date().isoformat()
 			name_str = activity['name']
 			distance = activity['distance_km']
-			running_total += distance
 			notes = []
 
 			if activity.get('is_chain_start'):
@@ -217,8 +60,10 @@ def main():
 		# Set up the Strava client
 		client = setup_client()
 
-		# Fetch all activities
-		all_activities = fetch_all_activities(client)
+		# Fetch new activities into the local cache and load the recent ones
+		conn = open_activity_db()
+		all_activities = fetch_all_activities(client, conn)
+		conn.close()
 
 		# Filter only cycling activities
 		ride_activities = filter_ride_activities(all_activities)
@@ -0,0 +1,352 @@
+# Shared Strava Chain Tracker logic
+# Authentication, activity fetching/caching and chain aggregation used by both
+# strava_chain_tracker.py and strava_chain_checker_html.py
+
+import os
+import datetime
+import sqlite3
+import time
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+
+# Chain emoji markers
+CHAIN_START_EMOJI = '⛓️'
+CHAIN_END_EMOJI = '⛓️‍💥'
+
+# Both markers begin with the bare chain character, which makes a cheap prescreen
+CHAIN_CHARACTER = CHAIN_START_EMOJI[0]
+
+# Local cache of fetched activities, so repeat runs only pull new ones from Strava plus the
+# last week again to catch edits (distances are stored in meters, exactly as Strava reports them)
+ACTIVITY_DB = 'activities.db'
+REFETCH_OVERLAP_DAYS = 7
+StoredActivity = namedtuple('StoredActivity', ['id', 'start_date', 'name', 'description', 'type', 'distance'])
+
+# Activity pages are requested from Strava a few at a time, using the largest page
+# size the API allows; when the 15-minute rate limit is hit we wait for it to reset
+ACTIVITIES_PER_PAGE = 200
+FETCH_CONCURRENCY = 4
+RATE_LIMIT_WINDOW = 15 * 60
+DAILY_RATE_LIMIT_WINDOW = 24 * 60 * 60
+MAX_RATE_LIMIT_WAIT = RATE_LIMIT_WINDOW
+
+# Report templates, and the same templates compiled ahead of time by compile_templates.py
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+COMPILED_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compiled_templates')
+
+# Templates never change while a report is rendering, so skip the per-render stat check
+ENV_OPTIONS = {
+	'autoescape': True,
+	'trim_blocks': True,
+	'lstrip_blocks': True,
+	'auto_reload': False,
+	'cache_size': 400
+}
+
+
+def compiled_templates_current():
+	"""Check whether the compiled templates exist and are newer than their sources"""
+	try:
+		compiled = [entry.stat().st_mtime for entry in os.scandir(COMPILED_TEMPLATE_DIR) if entry.name.endswith('.py')]
+	except FileNotFoundError:
+		return False
+
+	sources = [entry.stat().st_mtime for entry in os.scandir(TEMPLATE_DIR)]
+	return bool(compiled) and min(compiled) >= max(sources)
+
+
+def compile_templates():
+	"""Compile the Jinja templates to Python modules so later runs only have to import them"""
+	import jinja2
+
+	source_env = jinja2.Environment(loader=jinja2.PackageLoader('strava_core'), **ENV_OPTIONS)
+	source_env.compile_templates(
+		COMPILED_TEMPLATE_DIR,
+		zip=None,
+		filter_func=lambda name: not name.startswith('static_'),
+		ignore_errors=False
+	)
+	print(f"Templates compiled to {COMPILED_TEMPLATE_DIR}")
+
+
+@lru_cache(maxsize=None)
+def get_env():
+	"""Return the Jinja environment for the report templates, created once per interpreter
+
+	It loads the compiled templates when they are up to date and falls back to parsing
+	the sources. Built on first use so the Markdown report never imports Jinja.
+	"""
+	import jinja2
+
+	return jinja2.Environment(
+		loader=(
+			jinja2.ModuleLoader(COMPILED_TEMPLATE_DIR) if compiled_templates_current()
+			else jinja2.PackageLoader('strava_core')
+		),
+		**ENV_OPTIONS
+	)
+
+
+def setup_client():
+	"""Create and authenticate a Strava client"""
+	# stravalib pulls in requests, arrow, pytz etc., so only import it once it is needed
+	from dotenv import load_dotenv
+	from stravalib.client import Client
+
+	# Load the Strava API credentials from the .env file
+	load_dotenv()
+
+	client = Client()
+
+	# Exchange the refresh token for a fresh access token
+	refresh_response = client.refresh_access_token(
+		client_id=os.getenv('STRAVA_CLIENT_ID'),
+		client_secret=os.getenv('STRAVA_CLIENT_SECRET'),
+		refresh_token=os.getenv('STRAVA_REFRESH_TOKEN')
+	)
+
+	# Set the access token on the client
+	client.access_token = refresh_response['access_token']
+
+	return client
+
+
+def open_activity_db(path=ACTIVITY_DB):
+	"""Open the local activity cache, creating the table if needed"""
+	conn = sqlite3.connect(path)
+
+	# Write-ahead logging lets a batch of inserts commit with a single sync
+	conn.execute('PRAGMA journal_mode=WAL')
+	conn.execute('PRAGMA synchronous=NORMAL')
+
+	conn.execute(
+		'CREATE TABLE IF NOT EXISTS activities('
+		'id INTEGER PRIMARY KEY, start_date TEXT, name TEXT, description TEXT, type TEXT, distance_m REAL)'
+	)
+
+	# Bookkeeping such as the oldest start date the cache fully covers
+	conn.execute('CREATE TABLE IF NOT EXISTS cache_info(key TEXT PRIMARY KEY, value TEXT)')
+	return conn
+
+
+def load_activities(conn, since):
+	"""Load the cached activities that started on or after the given date"""
+	rows = conn.execute(
+		'SELECT id, start_date, name, description, type, distance_m FROM activities WHERE start_date >= ?',
+		(since.isoformat(),)
+	)
+
+	return [
+		StoredActivity(
+			id=activity_id,
+			start_date=datetime.datetime.fromisoformat(start_date),
+			name=name,
+			description=description,
+			type=activity_type,
+			distance=distance_m
+		)
+		for activity_id, start_date, name, description, activity_type, distance_m in rows
+	]
+
+
+def seconds_until_rate_limit_reset():
+	"""Seconds until Strava's 15-minute rate limit window resets (on the quarter hour)"""
+	return RATE_LIMIT_WINDOW - time.time() % RATE_LIMIT_WINDOW
+
+
+def fetch_activity_page(client, page, after_epoch):
+	"""Fetch one page of raw activities started after the given Unix timestamp"""
+	from stravalib import exc
+
+	while True:
+		try:
+			return client.protocol.get(
+				'/athlete/activities',
+				after=after_epoch,
+				page=page,
+				per_page=ACTIVITIES_PER_PAGE
+			)
+		except exc.RateLimitTimeout as e:
+			# The limit was already exceeded and its window hasn't passed; timeout is the time left
+			if e.timeout > MAX_RATE_LIMIT_WAIT:
+				raise
+			wait = e.timeout
+		except exc.RateLimitExceeded as e:
+			# The limit was just hit (including a 429 reporting its usage). stravalib 1.0 swaps
+			# the arguments here, so limit holds the window length rather than the request limit.
+			# Give up on the daily limit, otherwise wait for the 15-minute window to reset.
+			if e.limit == DAILY_RATE_LIMIT_WINDOW:
+				raise
+			wait = seconds_until_rate_limit_reset()
+		except exc.Fault as e:
+			# stravalib turns a 429 into RateLimitExceeded from the X-RateLimit headers;
+			# a bare 429 without those headers ends up here instead
+			if e.response is None or e.response.status_code != 429:
+				raise
+			wait = seconds_until_rate_limit_reset()
+
+		print(f"Strava rate limit reached, waiting {wait:.0f} seconds...")
+		time.sleep(wait)
+
+
+def activity_row(activity):
+	"""Convert a raw Strava activity into a row for the local cache"""
+	start_date = datetime.datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00'))
+
+	return (
+		activity['id'],
+		start_date.isoformat(),
+		activity['name'],
+		activity.get('description'),
+		activity['type'],
+		float(activity['distance'])
+	)
+
+
+def fetch_all_activities(client, conn, days=180):
+	"""Fetch new activities from Strava into the local cache and return those from the last few days"""
+	print(f'Fetching activities from the last {days} days...')
+
+	# Calculate the start of the window (in UTC, matching the cached start dates)
+	today = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+	window_start = today - datetime.timedelta(days=days)  # 180 days is approximately 6 months
+
+	# The cache holds every activity from covered_since onwards. If the window reaches further
+	# back than that (or nothing is cached yet), fetch the whole window.
+	covered_since = conn.execute("SELECT value FROM cache_info WHERE key = 'covered_since'").fetchone()
+	covered_since = datetime.datetime.fromisoformat(covered_since[0]) if covered_since else None
+	latest = conn.execute('SELECT MAX(start_date) FROM activities').fetchone()[0]
+
+	after = window_start
+	if covered_since is not None and covered_since <= window_start and latest:
+		# Otherwise only fetch newer activities, re-fetching a short overlap so that late
+		# uploads and recent rides renamed to add a chain marker are picked up
+		overlap_start = datetime.datetime.fromisoformat(latest) - datetime.timedelta(days=REFETCH_OVERLAP_DAYS)
+		after = max(window_start, overlap_start)
+
+	print(f"Getting activities since: {after.date().isoformat()}")
+
+	after_epoch = int(after.timestamp())
+
+	# The first page is all an incremental run usually needs, so only fan out when it is full
+	page_results = [fetch_activity_page(client, 1, after_epoch)]
+	next_page = 2
+
+	with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+		# Strava returns a short (or empty) page once there are no more activities
+		while len(page_results[-1]) == ACTIVITIES_PER_PAGE:
+			pages = range(next_page, next_page + FETCH_CONCURRENCY)
+			page_results.extend(executor.map(lambda page: fetch_activity_page(client, page, after_epoch), pages))
+			next_page += FETCH_CONCURRENCY
+
+			print(f"Fetched {sum(len(result) for result in page_results)} activities so far")
+
+	new_rows = [activity_row(activity) for result in page_results for activity in result]
+
+	# Store the new activities and the extended coverage in a single transaction
+	if covered_since is not None:
+		covered_since = min(covered_since, after)
+	else:
+		covered_since = after
+
+	with conn:
+		conn.executemany('INSERT OR REPLACE INTO activities VALUES (?, ?, ?, ?, ?, ?)', new_rows)
+		conn.execute(
+			"INSERT OR REPLACE INTO cache_info VALUES ('covered_since', ?)",
+			(covered_since.isoformat(),)
+		)
+	print(f"New activities fetched: {len(new_rows)}")
+
+	all_activities = load_activities(conn, window_start)
+	print(f"Total activities loaded: {len(all_activities)}")
+	return all_activities
+
+
+def filter_ride_activities(activities):
+	"""Filter only cycling activities"""
+	return [activity for activity in activities if activity.type == 'Ride']
+
+
+def classify_chain_markers(activity):
+	"""Check the name and description for chain markers, returning (is_chain_start, is_chain_end)"""
+	name = activity.name or ''
+	description = activity.description or ''
+
+	# Most activities have no marker at all, so rule them out with single-character searches
+	if CHAIN_CHARACTER not in name and CHAIN_CHARACTER not in description:
+		return False, False
+
+	# The end emoji contains the start emoji, so a field only counts as a start when it has
+	# no end marker. Each field is checked separately, so an activity can be both.
+	name_has_end = CHAIN_END_EMOJI in name
+	description_has_end = CHAIN_END_EMOJI in description
+
+	is_chain_start = (
+		(not name_has_end and CHAIN_START_EMOJI in name)
+		or (not description_has_end and CHAIN_START_EMOJI in description)
+	)
+
+	return is_chain_start, name_has_end or description_has_end
+
+
+def find_chain_spans(markers):
+	"""Find each chain as a (start, stop) index range over the per-activity chain markers"""
+	spans = []
+	chain_start = None
+
+	for i, (is_chain_start, is_chain_end) in enumerate(markers):
+		# Start a new chain if we see the start emoji, finalizing any open one
+		if is_chain_start:
+			if chain_start is not None:
+				spans.append((chain_start, i))
+			chain_start = i
+
+		# End the chain if we see the end emoji
+		if is_chain_end and chain_start is not None:
+			spans.append((chain_start, i + 1))
+			chain_start = None
+
+	# Add the last chain if it's still open
+	if chain_start is not None:
+		spans.append((chain_start, len(markers)))
+
+	return spans
+
+
+def aggregate_kilometers(activities):
+	"""Aggregate kilometers based on chain start and end emoji markers"""
+	# Sort activities by date (oldest first)
+	activities.sort(key=attrgetter('start_date'))
+
+	# Work out the chain boundaries first, so only activities inside a chain get converted
+	markers = [classify_chain_markers(activity) for activity in activities]
+
+	chains = []
+	for start, stop in find_chain_spans(markers):
+		chain_activities = activities[start:stop]
+
+		# Convert distances to kilometers and remove timezone info for easier formatting
+		distances_km = [activity.distance / 1000 for activity in chain_activities]
+		dates = [activity.start_date.replace(tzinfo=None) for activity in chain_activities]
+
+		chains.append({
+			'start_date': dates[0],
+			'end_date': dates[-1],
+			'activities': [
+				{
+					'id': activity.id,
+					'name': activity.name,
+					'date': date,
+					'distance_km': round(distance_km, 2),
+					'is_chain_start': is_chain_start,
+					'is_chain_end': is_chain_end
+				}
+				for activity, date, distance_km, (is_chain_start, is_chain_end)
+				in zip(chain_activities, dates, distances_km, markers[start:stop])
+			],
+			'total_km': sum(distances_km)
+		})
+
+	return chains